@@ -8,7 +8,7 @@ DB_FILE = "data/processed/supply_chain.db"
 
 def clean_column_names(df):
     """Standardize column names for SQL compatibility."""
-    df.columns = [c.lower().replace(' ', '_').replace('(', '').replace(')', '') for c in df.columns]
+    df.columns = df.columns.str.lower().str.replace(' ', '_', regex=False).str.replace('[()]', '', regex=True)
     return df
 
 def ingest_data():
@@ -17,31 +17,97 @@ def ingest_data():
         return
 
     print("== Starting ingestion...")
-    conn = sqlite3.connect(DB_FILE)
-    
-    # Process in chunks of 20,000 rows to save RAM
-    chunk_iter = pd.read_csv(CSV_FILE, encoding='ISO-8859-1', chunksize=20000)
-    
-    first_chunk = True
-    for chunk in chunk_iter:
-        chunk = clean_column_names(chunk)
-        
-        # Feature Engineering: Calculate Lead Time Variance
-        # Actual Days - Scheduled Days
-        if 'days_for_shipping_real' in chunk.columns:
-            chunk['lead_time_variance'] = chunk['days_for_shipping_real'] - chunk['days_for_shipment_scheduled']
-        
-        # Write to SQL
-        if first_chunk:
-            chunk.to_sql('orders', conn, if_exists='replace', index=False)
-            first_chunk = False
-        else:
-            chunk.to_sql('orders', conn, if_exists='append', index=False)
-        print(f" Processed a chunk... total rows so far: {pd.read_sql('SELECT COUNT(*) FROM orders', conn).iloc[0,0]}")
-
-    # Create an Index on 'order_region' for lightning-fast queries
-    conn.execute("CREATE INDEX idx_region ON orders(order_region)")
-    conn.close()
+    # Read and transform the CSV before touching the database, so a bad
+    # file leaves the existing tables untouched.
+    # The whole file is read in one pass (PyArrow), trading memory for speed
+    df = clean_column_names(pd.read_csv(CSV_FILE, encoding='ISO-8859-1', engine='pyarrow'))
+
+    # Feature Engineering: Calculate Lead Time Variance
+    # Actual Days - Scheduled Days
+    # (plain NumPy arrays, skipping Series alignment overhead)
+    if 'days_for_shipping_real' in df.columns:
+        real = df['days_for_shipping_real'].to_numpy()
+        scheduled = df['days_for_shipment_scheduled'].to_numpy()
+        df['lead_time_variance'] = real - scheduled
+
+    # Star schema for regions: each name is stored once in a lookup table
+    # and orders carry a small integer key, which keeps the table and its
+    # indexes compact and makes region filters integer comparisons
+    regions = df['order_region'].astype('category')
+    df.insert(df.columns.get_loc('order_region'), 'region_id', regions.cat.codes.astype('int64'))
+    df = df.drop(columns='order_region')
+
+    # Autocommit mode so the explicit BEGIN/COMMIT below is the only transaction
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    # The journal mode is stored in the file itself. Keep the default
+    # rollback journal (converting any WAL-mode file back) so the database
+    # stays a single file that opens read-only in a read-only directory;
+    # the load is one transaction, so WAL would not save any syncs anyway
+    conn.execute("PRAGMA journal_mode=DELETE")
+
+    # One transaction for the whole rebuild (SQLite DDL is transactional):
+    # if anything below fails, closing the connection rolls back to the
+    # previous tables, and readers never see a half-built schema
+    try:
+        conn.execute("BEGIN")
+
+        # Dropping orders also drops any indexes an older build left on it
+        conn.execute("DROP TABLE IF EXISTS orders")
+        conn.execute("DROP TABLE IF EXISTS regions")
+        conn.execute("DROP TABLE IF EXISTS region_summary")
+        conn.execute("DROP TABLE IF EXISTS region_category_summary")
+
+        conn.execute("CREATE TABLE regions (region_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+        conn.executemany("INSERT INTO regions VALUES (?, ?)", enumerate(regions.cat.categories))
+
+        # Create the table from the frame's dtypes and prepare a single INSERT.
+        # A few blank zipcodes make pandas parse the column as float; keep it
+        # INTEGER like the rest of the id-style columns.
+        conn.execute(pd.io.sql.get_schema(df, 'orders', con=conn, dtype={'customer_zipcode': 'INTEGER'}))
+        insert_sql = f"INSERT INTO orders VALUES ({','.join('?' * len(df.columns))})"
+
+        total_rows = 0
+        # Insert in 20,000-row batches so only one batch is ever boxed into
+        # Python objects at a time (keeps RAM flat)
+        for start in range(0, len(df), 20000):
+            batch = df.iloc[start:start + 20000]
+
+            # Write to SQL. Column-wise tolist() hands sqlite3 plain Python
+            # scalars far faster than itertuples() boxes them row by row.
+            rows = zip(*(batch[col].tolist() for col in batch.columns))
+            conn.executemany(insert_sql, rows)
+
+            # Running counter instead of a full-table COUNT(*) after every batch
+            total_rows += len(batch)
+            print(f" Processed a chunk... total rows so far: {total_rows}")
+
+        # Materialize the per-region aggregates the server serves; the data is
+        # static after ingest, so each tool call becomes a small lookup.
+        # orders itself gets no indexes: the server never reads it, and these
+        # one-off GROUP BYs are cheaper as a scan than building indexes for them
+        conn.execute("""
+        CREATE TABLE region_summary AS
+        SELECT
+            region_id,
+            COUNT(*) AS n,
+            AVG(lead_time_variance) AS avg_delay,
+            AVG(CASE WHEN late_delivery_risk = 1 THEN 100.0 ELSE 0 END) AS risk_pct
+        FROM orders GROUP BY region_id
+        """)
+        conn.execute("""
+        CREATE TABLE region_category_summary AS
+        SELECT region_id, category_name, AVG(lead_time_variance) AS delay
+        FROM orders GROUP BY region_id, category_name
+        """)
+        # Region lookups, including misses for unknown regions, are a single
+        # B-tree descent; the chart's top-5 reads straight off the index order
+        conn.execute("CREATE UNIQUE INDEX idx_region_summary ON region_summary(region_id)")
+        conn.execute("CREATE INDEX idx_region_category_delay ON region_category_summary(region_id, delay)")
+        # Refresh planner statistics for the server queries
+        conn.execute("ANALYZE")
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
     print(f"== Success! Database created at {DB_FILE}")
 
 if __name__ == "__main__":
@@ -1,10 +1,27 @@
+import asyncio
+import functools
+import hashlib
 import os
 import sqlite3
+import threading
+from collections import OrderedDict
+import matplotlib
+# Headless server: pin the non-interactive Agg backend before pyplot is
+# imported so no GUI backend is probed, and keep a local matplotlibrc
+# from switching on LaTeX rendering
+matplotlib.use('Agg')
+matplotlib.rcParams['text.usetex'] = False
+matplotlib.rcParams['path.simplify'] = True
+matplotlib.rcParams['agg.path.chunksize'] = 10000
 import matplotlib.pyplot as plt
 from dotenv import load_dotenv
 from fastmcp import FastMCP
 from fpdf import FPDF
 from google import genai 
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
 
 # 1. Configuration & Robust Pathing
 load_dotenv()
@@ -25,22 +42,53 @@ client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 # Initialize MCP Server
 mcp = FastMCP("SupplyChainAuditor")
 
+# One shared read-only connection keeps SQLite's page cache hot across
+# tool calls instead of reopening the file every time
+CONN = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True, check_same_thread=False)
+CONN.execute("PRAGMA cache_size=-65536")  # 64 MB page cache
+CONN.execute("PRAGMA mmap_size=268435456")  # 256 MB memory-mapped reads
+
+# Hot queries as module constants: sqlite3 caches the prepared statement
+# per connection keyed on the exact SQL text, so every call reuses it
+AUDIT_SQL = """
+SELECT n AS total_orders, avg_delay, risk_pct AS risk_percent
+FROM region_summary WHERE region_id = ?
+"""
+CHART_SQL = """
+SELECT category_name, delay
+FROM region_category_summary WHERE region_id = ?
+ORDER BY delay DESC LIMIT 5
+"""
+REGIONS_SQL = "SELECT name, region_id FROM regions ORDER BY name ASC"
+
+def _load_regions() -> dict[str, int]:
+    """Reads the canonical region name -> region_id mapping from the database."""
+    return dict(CONN.execute(REGIONS_SQL).fetchall())
+
+# Known regions are held in memory so tools can reject unknown input
+# before touching SQLite (or Gemini) and query by integer key
+_REGIONS = _load_regions()
+
+# The dataset is static between ingests, so query results are cached
+# in-process and dropped whenever the database file changes on disk
+DB_MTIME = os.path.getmtime(DB_FILE)
+
+def _refresh_caches():
+    """Clears cached query results if the database was rebuilt."""
+    global DB_MTIME, _REGIONS
+    mtime = os.path.getmtime(DB_FILE)
+    if mtime != DB_MTIME:
+        DB_MTIME = mtime
+        _REGIONS = _load_regions()
+        _audit_region_risk_impl.cache_clear()
+        _list_available_regions_impl.cache_clear()
+
 # 2. Tool: Data Auditing
-@mcp.tool()
-def audit_region_risk(region: str) -> str:
-    """Calculates risk metrics for a specific supply chain region."""
-    conn = sqlite3.connect(DB_FILE)
-    query = """
-    SELECT 
-        COUNT(*) as total_orders,
-        AVG(lead_time_variance) as avg_delay,
-        SUM(CASE WHEN late_delivery_risk = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*) as risk_percent
-    FROM orders WHERE order_region = ?
-    """
-    cursor = conn.cursor()
-    cursor.execute(query, (region,))
+@functools.lru_cache(maxsize=256)
+def _audit_region_risk_impl(region: str, region_id: int) -> str:
+    cursor = CONN.cursor()
+    cursor.execute(AUDIT_SQL, (region_id,))
     row = cursor.fetchone()
-    conn.close()
 
     if not row or row[0] == 0:
         return f"No data found for region: {region}"
@@ -49,52 +97,82 @@ def audit_region_risk(region: str) -> str:
             f"Avg Delay: {row[1]:.2f} days. "
             f"Late Delivery Risk: {row[2]:.1f}%.")
 
+@mcp.tool()
+def audit_region_risk(region: str) -> str:
+    """Calculates risk metrics for a specific supply chain region."""
+    _refresh_caches()
+    # Look the id up once: a concurrent _refresh_caches() can swap
+    # _REGIONS between a membership check and a second lookup
+    region_id = _REGIONS.get(region)
+    if region_id is None:
+        return f"No data found for region: {region}"
+    return _audit_region_risk_impl(region, region_id)
+
 # 3. Tool: Visual Analytics
+# One figure is reused for every chart instead of creating and tearing
+# down a new one per call; the lock keeps concurrent calls from drawing
+# on it (or rendering the same chart twice) at the same time
+_FIG, _AX = plt.subplots(figsize=(8, 5))
+_FIG_LOCK = threading.Lock()
+
 @mcp.tool()
 def generate_risk_chart(region: str) -> str:
     """Creates a bar chart showing delivery trends for a region."""
-    conn = sqlite3.connect(DB_FILE)
-    query = """
-    SELECT category_name, AVG(lead_time_variance) as delay 
-    FROM orders WHERE order_region = ? 
-    GROUP BY category_name ORDER BY delay DESC LIMIT 5
-    """
-    cursor = conn.cursor()
-    cursor.execute(query, (region,))
-    df_chart = cursor.fetchall()
-    conn.close()
-
-    if not df_chart:
-        return f"Could not find enough category data for {region}."
-
-    categories = [row[0] for row in df_chart]
-    delays = [row[1] for row in df_chart]
-
-    plt.figure(figsize=(8, 5))
-    plt.bar(categories, delays, color='skyblue')
-    plt.title(f"Top Delay Categories in {region}")
-    plt.ylabel("Avg Delay (Days)")
-    plt.xticks(rotation=45)
-    
+    _refresh_caches()
+    region_id = _REGIONS.get(region)
+    if region_id is None:
+        return f"No data found for region: {region}"
+
     # Save using absolute path
     chart_path = os.path.join(PROCESSED_DATA_DIR, f"{region}_risk_chart.png")
-    plt.savefig(chart_path, bbox_inches='tight')
-    plt.close() 
-    
+
+    with _FIG_LOCK:
+        # The chart only depends on the region and the static database, so a
+        # PNG newer than the database can be served as-is. Charts are only
+        # ever renamed into place complete, so an existing file is never a
+        # half-written one
+        if os.path.exists(chart_path) and os.path.getmtime(chart_path) > os.path.getmtime(DB_FILE):
+            return f" Cached chart available at {chart_path}"
+
+        cursor = CONN.cursor()
+        cursor.execute(CHART_SQL, (region_id,))
+        df_chart = cursor.fetchall()
+
+        if not df_chart:
+            return f"Could not find enough category data for {region}."
+
+        categories = [row[0] for row in df_chart]
+        delays = [row[1] for row in df_chart]
+
+        _AX.clear()
+        _AX.bar(categories, delays, color='skyblue')
+        _AX.set_title(f"Top Delay Categories in {region}")
+        _AX.set_ylabel("Avg Delay (Days)")
+        _AX.tick_params(axis='x', labelrotation=45)
+        # Render to a temp file next to the chart and rename it over the
+        # final path, so readers (and other server processes) only ever see
+        # a complete PNG, and a failed savefig leaves nothing behind
+        tmp_path = f"{chart_path}.{os.getpid()}.tmp"
+        try:
+            _FIG.savefig(tmp_path, format='png', bbox_inches='tight')
+            os.replace(tmp_path, chart_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
     return f" Chart generated and saved to {chart_path}"
 
 # 4. Tool: Professional Reporting
-@mcp.tool()
-def export_audit_pdf(region: str, audit_summary: str) -> str:
-    """Generates a professional PDF audit report using the new Gemini SDK."""
-    prompt = f"Act as a Supply Chain Expert. Write a formal 2-paragraph risk mitigation memo for {region} based on: {audit_summary}."
-    
-    response = client.models.generate_content(
-        model="gemini-2.0-flash", 
-        contents=prompt
-    )
-    narrative = response.text
+# Gemini narratives keyed by a hash of the prompt, so re-exporting the
+# same (region, audit_summary) skips the LLM round-trip. audit_summary is
+# free text from the caller, so the cache is an LRU capped like the
+# lru_cache'd query helpers instead of growing with every distinct prompt
+_NARRATIVE_CACHE_SIZE = 256
+_narrative_cache: OrderedDict[str, str] = OrderedDict()
 
+def _build_pdf_skeleton(region: str) -> FPDF:
+    """Lays out the report up to where the narrative begins."""
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", 'B', 16)
@@ -102,6 +180,10 @@ def export_audit_pdf(region: str, audit_summary: str) -> str:
     
     pdf.set_font("Arial", size=12)
     pdf.ln(10)
+    return pdf
+
+def _finish_pdf(pdf: FPDF, region: str, narrative: str) -> str:
+    """Adds the narrative and chart, then writes the report to disk."""
     pdf.multi_cell(0, 10, narrative)
     
     # Load chart using absolute path
@@ -112,19 +194,68 @@ def export_audit_pdf(region: str, audit_summary: str) -> str:
     pdf_filename = f"{region.replace(' ', '_')}_Audit_Report.pdf"
     pdf_path = os.path.join(PROCESSED_DATA_DIR, pdf_filename)
     pdf.output(pdf_path)
+    return pdf_path
+
+@mcp.tool()
+async def export_audit_pdf(region: str, audit_summary: str) -> str:
+    """Generates a professional PDF audit report using the new Gemini SDK."""
+    _refresh_caches()
+    if region not in _REGIONS:
+        return f"No data found for region: {region}"
+
+    prompt = f"Act as a Supply Chain Expert. Write a formal 2-paragraph risk mitigation memo for {region} based on: {audit_summary}."
+    
+    key = hashlib.sha1(prompt.encode()).hexdigest()
+    narrative = _narrative_cache.get(key)
+    if narrative is None:
+        # The Gemini round-trip dominates; lay out the PDF skeleton while
+        # waiting for the first tokens and collect the memo as it streams in
+        stream, pdf = await asyncio.gather(
+            client.aio.models.generate_content_stream(
+                model="gemini-2.0-flash", 
+                contents=prompt
+            ),
+            asyncio.to_thread(_build_pdf_skeleton, region),
+        )
+        parts = [chunk.text async for chunk in stream if chunk.text]
+        narrative = "".join(parts)
+        # A blocked or empty response streams chunks without text; report
+        # it instead of caching a blank memo and exporting an empty report
+        if not narrative:
+            return f"Could not generate an audit memo for {region}: Gemini returned no text."
+        _narrative_cache[key] = narrative
+        if len(_narrative_cache) > _NARRATIVE_CACHE_SIZE:
+            _narrative_cache.popitem(last=False)
+    else:
+        _narrative_cache.move_to_end(key)
+        pdf = await asyncio.to_thread(_build_pdf_skeleton, region)
+
+    # Rendering and file I/O stay off the event loop
+    pdf_path = await asyncio.to_thread(_finish_pdf, pdf, region, narrative)
     return f" Professional Report exported to {pdf_path}"
 
 # 5.
+@functools.lru_cache(maxsize=1)
+def _list_available_regions_impl() -> str:
+    # Dicts keep insertion order, which REGIONS_SQL sorts by name
+    return "Available regions: " + ", ".join(_REGIONS)
+
 @mcp.tool()
 def list_available_regions() -> str:
     """Returns a unique list of all regions present in the supply chain database."""
-    conn = sqlite3.connect(DB_FILE)
-    query = "SELECT DISTINCT order_region FROM orders ORDER BY order_region ASC"
-    regions = [row[0] for row in conn.execute(query).fetchall()]
-    conn.close()
-    return "Available regions: " + ", ".join(regions)
+    _refresh_caches()
+    return _list_available_regions_impl()
+
+# ASGI app for multi-worker deployments. Stateless HTTP because requests
+# from one client may land on any worker; each worker opens its own
+# read-only connection and caches:
+#   uvicorn server:app --port 8000 --workers 4 --loop uvloop
+app = mcp.http_app(stateless_http=True)
 
 if __name__ == "__main__":
     # Local Test: python server.py (Listens on port 8000)
     # Cloud: Entrypoint remains 'server.py'
-    mcp.run(transport="http", port=8000)
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.run(mcp.run_async(transport="http", port=8000))
+    else:
+        mcp.run(transport="http", port=8000)
\ No newline at end of file